@@ -1,10 +1,14 @@
 import streamlit as st
 import simpy
-import random
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go # Added for Gauge Chart
 import datetime
+from dataclasses import astuple, dataclass
+from joblib import Parallel, delayed
+
+from engine import STAGES, ProductionLine, logs_to_frame, part_generator, run_tandem, sample_streams, shift_output
 
 # --- PAGE CONFIG ---
 st.set_page_config(page_title="Factory Digital Twin V3.0 (Enterprise)", page_icon="🏭", layout="wide")
@@ -44,160 +48,237 @@ st.sidebar.markdown("---")
 st.sidebar.header("⏳ 3. Simulation Time")
 sim_duration = st.sidebar.number_input("Shift Duration (min)", value=480, help="8 Hours = 480 min")
 arrival_rate = st.sidebar.number_input("Arrival Interval (min)", value=5.0)
+ENGINES = ["Event Heap (fast)", "SimPy (reference)"]
+engine = st.sidebar.selectbox("DES Engine", ENGINES, help="Both engines run the same model on the same random draws")
+seed = st.sidebar.number_input("Random Seed", min_value=0, value=42, step=1, help="Same seed + same settings = same shift")
+n_reps = st.sidebar.number_input("Monte-Carlo Replications", min_value=1, max_value=500, value=1,
+                                 help="Re-run the shift with seeds seed, seed+1, ... across all CPU cores")
 
 # --- SIMULATION ENGINE ---
-class ProductionLine:
-    def __init__(self, env, c_prep, c_machining, c_qc, t_prep, t_machining, t_qc):
-        self.env = env
-        self.prep = simpy.Resource(env, capacity=c_prep)
-        self.machining = simpy.Resource(env, capacity=c_machining)
-        self.qc = simpy.Resource(env, capacity=c_qc)
-        
-        self.t_prep = t_prep
-        self.t_machining = t_machining
-        self.t_qc = t_qc
-        
-        self.logs = []
-
-    def process_part(self, name):
-        # STAGE 1
-        with self.prep.request() as req:
-            yield req
-            start = self.env.now
-            yield self.env.timeout(random.expovariate(1.0/self.t_prep))
-            self.log_data(name, "1. Prep", start, self.env.now)
-
-        # STAGE 2
-        with self.machining.request() as req:
-            yield req
-            start = self.env.now
-            yield self.env.timeout(random.expovariate(1.0/self.t_machining))
-            self.log_data(name, "2. Machining", start, self.env.now)
-
-        # STAGE 3
-        with self.qc.request() as req:
-            yield req
-            start = self.env.now
-            yield self.env.timeout(random.expovariate(1.0/self.t_qc))
-            self.log_data(name, "3. QC", start, self.env.now)
-
-    def log_data(self, name, stage, start, finish):
-        self.logs.append({
-            'Part': name,
-            'Stage': stage,
-            'Start': start,
-            'Finish': finish,
-            'Duration': finish - start
-        })
-
-def part_generator(env, factory, interval):
-    i = 0
-    while True:
-        yield env.timeout(random.expovariate(1.0 / interval))
-        i += 1
-        env.process(factory.process_part(f"Part-{i:03d}"))
+@dataclass(frozen=True)
+class SimInputs:
+    # Everything that shapes the DES log; financial settings are deliberately not part of it
+    caps: tuple
+    means: tuple
+    sim_duration: float
+    arrival_rate: float
+    seed: int
+    engine: str
 
-# --- MAIN LOGIC ---
-if st.button("🚀 Run Enterprise Simulation"):
+@st.cache_data(max_entries=32, show_spinner="Calculating Physics & Financials...")
+def run_simulation(c_prep, c_machining, c_qc, t_prep, t_machining, t_qc, sim_duration, arrival_rate, seed,
+                   engine=ENGINES[0]):
+    # Only the DES inputs are arguments, so financial tweaks never re-run the engine
+    gaps, service_times = sample_streams(t_prep, t_machining, t_qc, arrival_rate, sim_duration, seed)
+    if engine == ENGINES[0]:
+        return logs_to_frame(*run_tandem((c_prep, c_machining, c_qc), gaps, service_times, sim_duration))
     env = simpy.Environment()
-    factory = ProductionLine(env, c_prep, c_machining, c_qc, t_prep, t_machining, t_qc)
-    env.process(part_generator(env, factory, arrival_rate))
+    factory = ProductionLine(env, c_prep, c_machining, c_qc, service_times)
+    env.process(part_generator(env, factory, gaps))
+    env.run(until=sim_duration)
+    return factory.to_frame()
+
+@st.cache_data(max_entries=32, show_spinner="Running Monte-Carlo replications...")
+def run_replications(caps, means, sim_duration, arrival_rate, seed, n_reps):
+    # Replications share nothing, so they fan out over all cores; returns finished parts per seed.
+    # loky workers import only `engine` (they never re-run this script) and are reused across calls
+    outputs = Parallel(n_jobs=-1, backend="loky")(
+        delayed(shift_output)(caps, means, arrival_rate, sim_duration, s) for s in range(seed, seed + n_reps))
+    return np.array(outputs, dtype=np.int64)
+
+# --- KPI MODEL ---
+@dataclass(frozen=True)
+class ShiftKPIs:
+    finished_parts: int
+    shift_hours: float
+    total_revenue: float
+    total_op_cost: float
+    total_mat_cost: float
+    net_profit: float
+    roi_margin: float
+    avg_flow_time: float
+    utils: dict
+    bottleneck_stage: str
+
+@st.cache_data(max_entries=32, show_spinner=False,
+               hash_funcs={pd.DataFrame: lambda d: pd.util.hash_pandas_object(d, index=True).values.tobytes()})
+def compute_kpis(df, price, cost_hr, raw_cost, caps, sim_duration):
+    stage_codes = df['Stage'].cat.codes.values
+
+    # Throughput
+    finished_parts = int(np.count_nonzero(stage_codes == 2))
     
-    with st.spinner("Calculating Physics & Financials..."):
-        env.run(until=sim_duration)
+    # --- 2. FINANCIAL CALCULATIONS (NEW!) ---
+    total_revenue = finished_parts * price
     
-    df = pd.DataFrame(factory.logs)
+    # Operating Cost = (Total Machines * Cost per hour * Hours)
+    total_machines = sum(caps)
+    shift_hours = sim_duration / 60
+    total_op_cost = total_machines * cost_hr * shift_hours
     
-    if not df.empty:
-        # --- 1. DATA PROCESSING ---
-        base_time = pd.Timestamp.now().replace(hour=8, minute=0, second=0, microsecond=0)
-        df['Start_Time'] = base_time + pd.to_timedelta(df['Start'], unit='m')
-        df['Finish_Time'] = base_time + pd.to_timedelta(df['Finish'], unit='m')
+    # Material Cost
+    total_mat_cost = finished_parts * raw_cost
+    
+    # Net Profit
+    net_profit = total_revenue - (total_op_cost + total_mat_cost)
+    roi_margin = (net_profit / total_revenue * 100) if total_revenue > 0 else 0
 
-        # Throughput
-        finished_parts = len(df[df['Stage']=='3. QC'])
-        
-        # --- 2. FINANCIAL CALCULATIONS (NEW!) ---
-        total_revenue = finished_parts * price_per_unit
-        
-        # Operating Cost = (Total Machines * Cost per hour * Hours)
-        total_machines = c_prep + c_machining + c_qc
-        shift_hours = sim_duration / 60
-        total_op_cost = total_machines * cost_per_hour * shift_hours
-        
-        # Material Cost
-        total_mat_cost = finished_parts * raw_material_cost
-        
-        # Net Profit
-        net_profit = total_revenue - (total_op_cost + total_mat_cost)
-        roi_margin = (net_profit / total_revenue * 100) if total_revenue > 0 else 0
-
-        # --- 3. UTILIZATION & BOTTLENECK ---
-        total_time = sim_duration
-        util_prep = df[df['Stage']=="1. Prep"]['Duration'].sum() / (c_prep * total_time) * 100
-        util_mach = df[df['Stage']=="2. Machining"]['Duration'].sum() / (c_machining * total_time) * 100
-        util_qc = df[df['Stage']=="3. QC"]['Duration'].sum() / (c_qc * total_time) * 100
-        
-        utils = {"Prep": util_prep, "Machining": util_mach, "QC": util_qc}
-        bottleneck_stage = max(utils, key=utils.get)
-        
-        st.success("Simulation & Financial Analysis Complete!")
+    # --- 3. UTILIZATION & BOTTLENECK ---
+    # Busy minutes per stage in a single pass over the log
+    busy = np.bincount(stage_codes, weights=df['Duration'].values, minlength=3)
+    util_pct = busy / (np.asarray(caps) * sim_duration) * 100
+    
+    utils = dict(zip(["Prep", "Machining", "QC"], util_pct.tolist()))
+    bottleneck_stage = max(utils, key=utils.get)
 
-        # --- DASHBOARD ROW 1: FINANCIALS 💰 ---
-        st.markdown("### 💰 Financial Performance (8hr Shift)")
-        f1, f2, f3, f4 = st.columns(4)
-        f1.metric("Total Revenue", f"€ {total_revenue:,.0f}")
-        f2.metric("Total Cost (Op + Mat)", f"€ {(total_op_cost + total_mat_cost):,.0f}", delta="Expenses", delta_color="inverse")
-        f3.metric("Net Profit", f"€ {net_profit:,.0f}", delta=f"{roi_margin:.1f}% Margin")
-        
-        # Gauge Chart for OEE/Efficiency
-        fig_gauge = go.Figure(go.Indicator(
-            mode = "gauge+number",
-            value = utils[bottleneck_stage],
-            title = {'text': f"Bottleneck OEE ({bottleneck_stage})"},
-            gauge = {'axis': {'range': [0, 100]},
-                     'bar': {'color': "darkblue"},
-                     'steps' : [
-                         {'range': [0, 50], 'color': "#ffcccb"},
-                         {'range': [50, 85], 'color': "lightyellow"},
-                         {'range': [85, 100], 'color': "lightgreen"}],
-                     'threshold' : {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 90}}))
-        fig_gauge.update_layout(height=200, margin=dict(l=20,r=20,t=50,b=20))
-        
-        with f4:
-            st.plotly_chart(fig_gauge, use_container_width=True)
-
-        # --- DASHBOARD ROW 2: OPERATIONS ⚙️ ---
-        st.markdown("### ⚙️ Operational KPIs")
-        k1, k2, k3, k4 = st.columns(4)
-        k1.metric("Production Output", f"{finished_parts} Units")
-        k2.metric("Avg Lead Time", f"{(df['Finish'] - df['Start']).mean():.1f} min")
-        k3.metric("Bottleneck Station", f"🚩 {bottleneck_stage}")
-        k4.metric("Throughput Rate", f"{finished_parts/shift_hours:.1f} units/hr")
-
-        # --- VISUALIZATION TABS ---
-        tab1, tab2 = st.tabs(["🗓️ Gantt Schedule", "📊 Machine Utilization"])
+    # Flow time of finished parts: QC finish minus Prep start, so Machining/QC queueing counts.
+    # The log has no arrival times, so only the wait in front of Prep is left out
+    part_ids = df['Part_id'].values
+    prep, qc = stage_codes == 0, stage_codes == 2
+    prep_start = np.zeros(part_ids.max() + 1)
+    prep_start[part_ids[prep]] = df['Start'].values[prep]
+    flow_times = df['Finish'].values[qc].astype(np.float64) - prep_start[part_ids[qc]]
+    avg_flow_time = float(flow_times.mean()) if finished_parts else 0.0
+
+    return ShiftKPIs(finished_parts, shift_hours, total_revenue, total_op_cost, total_mat_cost,
+                     net_profit, roi_margin, avg_flow_time, utils, bottleneck_stage)
+
+# --- CHART BUILDERS ---
+# Figures are shared across reruns and sessions: finish every update_layout in here, never mutate the result
+@st.cache_resource(max_entries=16)
+def build_gauge(value, label):
+    # Gauge Chart for OEE/Efficiency
+    fig_gauge = go.Figure(go.Indicator(
+        mode = "gauge+number",
+        value = value,
+        title = {'text': f"Bottleneck OEE ({label})"},
+        gauge = {'axis': {'range': [0, 100]},
+                 'bar': {'color': "darkblue"},
+                 'steps' : [
+                     {'range': [0, 50], 'color': "#ffcccb"},
+                     {'range': [50, 85], 'color': "lightyellow"},
+                     {'range': [85, 100], 'color': "lightgreen"}],
+                 'threshold' : {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 90}}))
+    fig_gauge.update_layout(height=200, margin=dict(l=20,r=20,t=50,b=20))
+    return fig_gauge
+
+@st.cache_resource(max_entries=16)
+def build_gantt(part_ids, starts, finishes, stages, base_time):
+    # Labels and wall-clock times are only built for the rows on the chart
+    gantt_df = pd.DataFrame({'Part': [f"Part-{i:03d}" for i in part_ids], 'Stage': stages,
+                             'Start_Time': base_time + pd.to_timedelta(list(starts), unit='m'),
+                             'Minutes': np.subtract(finishes, starts)})
+    # One horizontal bar trace per stage; on a date axis each bar spans [base, base + x ms]
+    fig_gantt = go.Figure()
+    for stage, color in zip(STAGES, px.colors.qualitative.Bold):
+        rows = gantt_df[gantt_df['Stage'] == stage]
+        fig_gantt.add_trace(go.Bar(
+            x=rows['Minutes'] * 60_000, y=rows['Part'], base=rows['Start_Time'], orientation='h',
+            name=stage, marker_color=color, customdata=rows['Minutes'],
+            hovertemplate="%{y}<br>Start %{base|%H:%M:%S}<br>%{customdata:.1f} min<extra>%{fullData.name}</extra>"))
+    fig_gantt.update_layout(
+        title="Digital Twin Timeline", barmode='overlay', xaxis_type='date', legend_title_text="Stage",
+        height=max(450, 22 * len(set(part_ids))), uirevision='gantt'  # keep zoom/pan across reruns
+    )
+    fig_gantt.update_yaxes(autorange="reversed", categoryorder='array',
+                           categoryarray=[f"Part-{i:03d}" for i in sorted(set(part_ids))])
+    return fig_gantt
+
+@st.cache_resource(max_entries=16)
+def build_util_chart(utils_items):
+    util_df = pd.DataFrame(list(utils_items), columns=['Stage', 'Utilization (%)'])
+    return px.bar(util_df, x='Stage', y='Utilization (%)', color='Utilization (%)', 
+                  color_continuous_scale='RdYlGn_r', range_y=[0, 100])
+
+# --- DASHBOARD ---
+def _compat_fragment(fn):
+    # st.fragment landed in Streamlit 1.37; older releases only ship the experimental name
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    return fragment(fn) if fragment is not None else fn
+
+@_compat_fragment
+def render_dashboard(df, kpis, run_inputs):
+    # Widget edits inside the fragment rerun only this function, with the same df/kpis/run_inputs
+
+    # --- DASHBOARD ROW 1: FINANCIALS 💰 ---
+    st.markdown("### 💰 Financial Performance (8hr Shift)")
+    f1, f2, f3, f4 = st.columns(4)
+    f1.metric("Total Revenue", f"€ {kpis.total_revenue:,.0f}")
+    f2.metric("Total Cost (Op + Mat)", f"€ {(kpis.total_op_cost + kpis.total_mat_cost):,.0f}", delta="Expenses", delta_color="inverse")
+    f3.metric("Net Profit", f"€ {kpis.net_profit:,.0f}", delta=f"{kpis.roi_margin:.1f}% Margin")
+    
+    with f4:
+        st.plotly_chart(build_gauge(kpis.utils[kpis.bottleneck_stage], kpis.bottleneck_stage), use_container_width=True)
+
+    # --- DASHBOARD ROW 2: OPERATIONS ⚙️ ---
+    st.markdown("### ⚙️ Operational KPIs")
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Production Output", f"{kpis.finished_parts} Units")
+    k2.metric("Avg Flow Time (from Prep)", f"{kpis.avg_flow_time:.1f} min",
+              help="Finished parts only: QC finish minus Prep start, queueing included")
+    k3.metric("Bottleneck Station", f"🚩 {kpis.bottleneck_stage}")
+    k4.metric("Throughput Rate", f"{kpis.finished_parts/kpis.shift_hours:.1f} units/hr")
+
+    # --- VISUALIZATION TABS ---
+    tab1, tab2, tab3 = st.tabs(["🗓️ Gantt Schedule", "📊 Machine Utilization", "🎲 Monte-Carlo"])
+    
+    with tab1:
+        n_show = st.slider("Show first K parts", 5, 200, 20, step=5)
+        st.markdown(f"#### Production Schedule (First {n_show} Parts)")
+        # Part ids are assigned in arrival order from 1, so the first K parts are a plain id cut
+        gantt_df = df[df['Part_id'].values <= n_show]
+        base_time = pd.Timestamp.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        fig_gantt = build_gantt(tuple(gantt_df['Part_id'].tolist()), tuple(gantt_df['Start'].tolist()),
+                                tuple(gantt_df['Finish'].tolist()), tuple(gantt_df['Stage'].tolist()), base_time)
+        st.plotly_chart(fig_gantt, use_container_width=True)
         
-        with tab1:
-            st.markdown("#### Production Schedule (First 20 Parts)")
-            unique_parts = sorted(df['Part'].unique())[:20]
-            gantt_df = df[df['Part'].isin(unique_parts)].copy()
-            
-            fig_gantt = px.timeline(
-                gantt_df, x_start="Start_Time", x_end="Finish_Time", y="Part", color="Stage",
-                title="Digital Twin Timeline", color_discrete_sequence=px.colors.qualitative.Bold
-            )
-            fig_gantt.update_yaxes(autorange="reversed") 
-            st.plotly_chart(fig_gantt, use_container_width=True)
-            
-        with tab2:
-            util_df = pd.DataFrame({'Stage': list(utils.keys()), 'Utilization (%)': list(utils.values())})
-            fig_util = px.bar(util_df, x='Stage', y='Utilization (%)', color='Utilization (%)', 
-                              color_continuous_scale='RdYlGn_r', range_y=[0, 100])
-            st.plotly_chart(fig_util, use_container_width=True)
-
-        with st.expander("📂 View Detailed Production Logs"):
-            st.dataframe(df)
+    with tab2:
+        st.plotly_chart(build_util_chart(tuple(kpis.utils.items())), use_container_width=True)
+
+    with tab3:
+        if n_reps > 1:
+            # Replay the line that produced the log, not whatever the sidebar shows now
+            outputs = run_replications(run_inputs.caps, run_inputs.means, run_inputs.sim_duration,
+                                       run_inputs.arrival_rate, run_inputs.seed, int(n_reps))
+            profits = outputs * (price_per_unit - raw_material_cost) - kpis.total_op_cost
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Mean Output", f"{outputs.mean():.1f} ± {outputs.std():.1f} Units")
+            m2.metric("Mean Net Profit", f"€ {profits.mean():,.0f} ± {profits.std():,.0f}")
+            m3.metric("Loss Probability", f"{(profits < 0).mean() * 100:.1f} %")
+            fig_mc = px.histogram(x=outputs, nbins=30, labels={'x': 'Finished Units per Shift'},
+                                  title=f"Output Distribution over {n_reps} Shifts")
+            st.plotly_chart(fig_mc, use_container_width=True)
+        else:
+            st.info("Set Monte-Carlo Replications above 1 to see the output and profit spread.")
+
+    with st.expander("📂 View Detailed Production Logs"):
+        st.dataframe(df)
+
+# --- MAIN LOGIC ---
+sim_inputs = SimInputs((c_prep, c_machining, c_qc), (t_prep, t_machining, t_qc),
+                       sim_duration, arrival_rate, int(seed), engine)
+
+if st.button("🚀 Run Enterprise Simulation"):
+    df = run_simulation(c_prep, c_machining, c_qc, t_prep, t_machining, t_qc,
+                        sim_duration, arrival_rate, int(seed), engine)
+    
+    if not df.empty:
+        # Survives later reruns (sidebar edits, dashboard widgets) until the next button press.
+        # Only the DES result is kept: KPIs are re-derived below so financial edits apply live
+        st.session_state.last_result = (sim_inputs, df)
+
+        st.success("Simulation & Financial Analysis Complete!")
             
     else:
-        st.warning("No production. Increase time or arrival rate.")
\ No newline at end of file
+        st.session_state.pop("last_result", None)
+        st.warning("No production. Increase time or arrival rate.")
+
+if res := st.session_state.get("last_result"):
+    run_inputs, df = res
+    # Compare field values: every rerun redefines SimInputs, so dataclass == never matches across runs
+    if astuple(run_inputs) != astuple(sim_inputs):
+        st.info("Production or time settings changed since the last run; press Run to simulate them. "
+                "The dashboard below still shows the last run, with the current financial settings.")
+    kpis = compute_kpis(df, price_per_unit, cost_per_hour, raw_material_cost,
+                        run_inputs.caps, run_inputs.sim_duration)
+    render_dashboard(df, kpis, run_inputs)
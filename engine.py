@@ -0,0 +1,184 @@
+"""Discrete-event engines for the Prep -> Machining -> QC line.
+
+Kept free of Streamlit so Monte-Carlo replications can run in worker processes.
+"""
+import heapq
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import simpy
+
+try:
+    import pyximport
+    pyximport.install(language_level=3)
+    from run_tandem import run_tandem as run_tandem_c
+except ImportError:  # No Cython or no C compiler; run_tandem falls back to run_tandem_py
+    run_tandem_c = None
+
+STAGES = ["1. Prep", "2. Machining", "3. QC"]
+STAGE_DTYPE = pd.CategoricalDtype(STAGES, ordered=True)
+
+def sample_streams(t_prep, t_machining, t_qc, arrival_rate, sim_duration, seed):
+    """Pre-draws inter-arrival gaps for every part arriving in the shift, plus its three service times."""
+    # One PCG64 stream per quantity, so changing one mean leaves the other draws untouched
+    arrival_rng, *service_rngs = (np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(4))
+    n = int(sim_duration / arrival_rate * 1.5) + 1
+    gaps = arrival_rng.exponential(arrival_rate, n)
+    while gaps.sum() < sim_duration:
+        gaps = np.concatenate((gaps, arrival_rng.exponential(arrival_rate, n)))
+    n_parts = int(np.searchsorted(np.cumsum(gaps), sim_duration))
+    services = tuple(rng.exponential(mean, n_parts)
+                     for rng, mean in zip(service_rngs, (t_prep, t_machining, t_qc)))
+    return gaps[:n_parts], services
+
+_FAST_SLOT = object()  # occupies a place in Resource.users for parts seized without a Request
+
+class ProductionLine:
+    def __init__(self, env, c_prep, c_machining, c_qc, service_times):
+        self.env = env
+        self.prep = simpy.Resource(env, capacity=c_prep)
+        self.machining = simpy.Resource(env, capacity=c_machining)
+        self.qc = simpy.Resource(env, capacity=c_qc)
+        
+        self._prep_times, self._machining_times, self._qc_times = service_times
+        
+        # Struct-of-arrays log: one row per finished stage, filled via the _n cursor
+        cap = 3 * len(self._prep_times)
+        self._part_ids = np.empty(cap, np.int32)
+        self._stages = np.empty(cap, np.int8)
+        self._starts = np.empty(cap, np.float32)
+        self._finishes = np.empty(cap, np.float32)
+        self._n = 0
+
+    def process_part(self, part_id):
+        # STAGE 1
+        start = yield from self.seize(self.prep, self._prep_times[part_id - 1])
+        self.log_data(part_id, 0, start, self.env.now)
+
+        # STAGE 2
+        start = yield from self.seize(self.machining, self._machining_times[part_id - 1])
+        self.log_data(part_id, 1, start, self.env.now)
+
+        # STAGE 3
+        start = yield from self.seize(self.qc, self._qc_times[part_id - 1])
+        self.log_data(part_id, 2, start, self.env.now)
+
+    def seize(self, resource, service_time):
+        """Holds one machine of `resource` for `service_time` and returns the service start time."""
+        if len(resource.users) < resource.capacity and not resource.queue:
+            # Uncontended: take the slot directly, skipping the Request event and its context manager
+            resource.users.append(_FAST_SLOT)
+            start = self.env.now
+            yield self.env.timeout(service_time)
+            resource.users.remove(_FAST_SLOT)
+            resource._trigger_put(None)
+        else:
+            with resource.request() as req:
+                yield req
+                start = self.env.now
+                yield self.env.timeout(service_time)
+        return start
+
+    def log_data(self, part_id, stage, start, finish):
+        i = self._n
+        self._part_ids[i] = part_id
+        self._stages[i] = stage
+        self._starts[i] = start
+        self._finishes[i] = finish
+        self._n = i + 1
+
+    def to_frame(self):
+        n = self._n
+        return logs_to_frame(self._part_ids[:n], self._stages[:n], self._starts[:n], self._finishes[:n])
+
+def part_generator(env, factory, gaps):
+    for i, gap in enumerate(gaps, start=1):
+        yield env.timeout(gap)
+        env.process(factory.process_part(i))
+
+def run_tandem_py(caps, gaps, service_times, sim_duration):
+    """Same line as ProductionLine, run on a plain heapq event loop instead of SimPy processes."""
+    n_parts = len(gaps)
+    arrivals = np.cumsum(gaps).tolist()
+    services = [t.tolist() for t in service_times]
+
+    part_ids = np.empty(3 * n_parts, np.int32)
+    stages = np.empty(3 * n_parts, np.int8)
+    starts = np.empty(3 * n_parts, np.float32)
+    finishes = np.empty(3 * n_parts, np.float32)
+    n = 0
+
+    free = list(caps)
+    queues = [deque(), deque(), deque()]
+    started = [0.0] * n_parts
+    # Stage-finish events only; arrivals are read straight off the sorted stream. Entries stay
+    # (time, stage, part) tuples: packed int keys measured ~40% slower here, and GC never kicks in
+    events = []
+    push, pop = heapq.heappush, heapq.heappop
+    prep_queue, prep_service = queues[0], services[0]
+    nxt_arrival = 0
+
+    while True:
+        # Batch every arrival due before the next finish: between them only Prep's state changes
+        horizon = events[0][0] if events else sim_duration
+        while nxt_arrival < n_parts and arrivals[nxt_arrival] < horizon:
+            now = arrivals[nxt_arrival]
+            if free[0]:
+                free[0] -= 1
+                started[nxt_arrival] = now
+                done = now + prep_service[nxt_arrival]
+                push(events, (done, 0, nxt_arrival))
+                if done < horizon:
+                    horizon = done
+            else:
+                prep_queue.append(nxt_arrival)
+            nxt_arrival += 1
+
+        if not events:
+            break
+        now, stage, pid = pop(events)
+        if now >= sim_duration:
+            break
+        part_ids[n] = pid + 1
+        stages[n] = stage
+        starts[n] = started[pid]
+        finishes[n] = now
+        n += 1
+        # Hand the freed machine to the head of this stage's queue
+        if queues[stage]:
+            nxt = queues[stage].popleft()
+            started[nxt] = now
+            push(events, (now + services[stage][nxt], stage, nxt))
+        else:
+            free[stage] += 1
+        if stage == 2:
+            continue
+        stage += 1
+        if free[stage]:
+            free[stage] -= 1
+            started[pid] = now
+            push(events, (now + services[stage][pid], stage, pid))
+        else:
+            queues[stage].append(pid)
+
+    return part_ids[:n], stages[:n], starts[:n], finishes[:n]
+
+run_tandem = run_tandem_c or run_tandem_py
+
+def logs_to_frame(part_ids, stages, starts, finishes):
+    # Compact dtypes throughout: "Part-001" labels are only built for the rows a chart shows
+    return pd.DataFrame({
+        'Part_id': part_ids.astype(np.int32, copy=False),
+        'Stage': pd.Categorical.from_codes(stages, dtype=STAGE_DTYPE),
+        'Start': starts.astype(np.float32, copy=False),
+        'Finish': finishes.astype(np.float32, copy=False),
+        'Duration': (finishes - starts).astype(np.float32, copy=False)
+    })
+
+
+def shift_output(caps, means, arrival_rate, sim_duration, seed):
+    """Finished parts for one replication of the shift; the unit of work for the Monte-Carlo pool."""
+    gaps, service_times = sample_streams(*means, arrival_rate, sim_duration, seed)
+    _, stages, _, _ = run_tandem(caps, gaps, service_times, sim_duration)
+    return int(np.count_nonzero(stages == 2))
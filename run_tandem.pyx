@@ -0,0 +1,156 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""Compiled twin of engine.run_tandem_py.
+
+Same events, same (time, stage, part) tie-breaking and the same pre-drawn
+streams, so both loops write identical logs; this one just keeps the whole
+event loop in C with the GIL released.
+"""
+import numpy as np
+from libc.stdlib cimport malloc, free
+
+cdef struct Event:
+    double time
+    int stage
+    int pid
+
+cdef inline bint before(Event a, Event b) noexcept nogil:
+    if a.time != b.time:
+        return a.time < b.time
+    if a.stage != b.stage:
+        return a.stage < b.stage
+    return a.pid < b.pid
+
+cdef class Heap:
+    """Binary min-heap of Event structs with a fixed capacity."""
+    cdef Event* data
+    cdef Py_ssize_t size
+
+    def __cinit__(self, Py_ssize_t capacity):
+        self.data = <Event*> malloc(max(capacity, 1) * sizeof(Event))
+        if self.data == NULL:
+            raise MemoryError()
+        self.size = 0
+
+    def __dealloc__(self):
+        free(self.data)
+
+    cdef inline void push(self, double time, int stage, int pid) noexcept nogil:
+        cdef Event ev
+        cdef Py_ssize_t i = self.size, parent
+        ev.time = time
+        ev.stage = stage
+        ev.pid = pid
+        self.size += 1
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not before(ev, self.data[parent]):
+                break
+            self.data[i] = self.data[parent]
+            i = parent
+        self.data[i] = ev
+
+    cdef inline Event pop(self) noexcept nogil:
+        cdef Event top = self.data[0]
+        cdef Event last
+        cdef Py_ssize_t i = 0, child
+        self.size -= 1
+        last = self.data[self.size]
+        while True:
+            child = 2 * i + 1
+            if child >= self.size:
+                break
+            if child + 1 < self.size and before(self.data[child + 1], self.data[child]):
+                child += 1
+            if not before(self.data[child], last):
+                break
+            self.data[i] = self.data[child]
+            i = child
+        self.data[i] = last
+        return top
+
+
+def run_tandem(caps, gaps, service_times, double sim_duration):
+    cdef Py_ssize_t n_parts = len(gaps)
+    cdef double[::1] arrivals = np.cumsum(gaps, dtype=np.float64)
+    cdef double[:, ::1] services = np.ascontiguousarray(np.stack(service_times), dtype=np.float64)
+
+    part_ids_arr = np.empty(3 * n_parts, np.int32)
+    stages_arr = np.empty(3 * n_parts, np.int8)
+    starts_arr = np.empty(3 * n_parts, np.float32)
+    finishes_arr = np.empty(3 * n_parts, np.float32)
+    cdef int[::1] part_ids = part_ids_arr
+    cdef signed char[::1] stages = stages_arr
+    cdef float[::1] starts = starts_arr
+    cdef float[::1] finishes = finishes_arr
+    cdef Py_ssize_t n = 0
+
+    # Each part joins each queue at most once, so a flat array per stage
+    # with head/tail cursors is a FIFO that never needs to wrap
+    cdef int[:, ::1] queues = np.empty((3, max(n_parts, 1)), np.int32)
+    cdef Py_ssize_t head[3]
+    cdef Py_ssize_t tail[3]
+    cdef int free_[3]
+    cdef double[::1] started = np.zeros(max(n_parts, 1))
+    # Stage-finish events only, at most one pending per part; arrivals are
+    # read straight off the sorted stream
+    cdef Heap events = Heap(n_parts)
+
+    cdef Event ev
+    cdef double now, done, horizon
+    cdef int stage, nxt
+    cdef Py_ssize_t nxt_arrival = 0
+    for stage in range(3):
+        free_[stage] = caps[stage]
+        head[stage] = 0
+        tail[stage] = 0
+
+    with nogil:
+        while True:
+            # Batch every arrival due before the next finish: between them only Prep's state changes
+            horizon = events.data[0].time if events.size > 0 else sim_duration
+            while nxt_arrival < n_parts and arrivals[nxt_arrival] < horizon:
+                now = arrivals[nxt_arrival]
+                if free_[0] > 0:
+                    free_[0] -= 1
+                    started[nxt_arrival] = now
+                    done = now + services[0, nxt_arrival]
+                    events.push(done, 0, <int> nxt_arrival)
+                    if done < horizon:
+                        horizon = done
+                else:
+                    queues[0, tail[0]] = <int> nxt_arrival
+                    tail[0] += 1
+                nxt_arrival += 1
+
+            if events.size == 0:
+                break
+            ev = events.pop()
+            now = ev.time
+            if now >= sim_duration:
+                break
+            stage = ev.stage
+            part_ids[n] = ev.pid + 1
+            stages[n] = <signed char> stage
+            starts[n] = <float> started[ev.pid]
+            finishes[n] = <float> now
+            n += 1
+            # Hand the freed machine to the head of this stage's queue
+            if head[stage] < tail[stage]:
+                nxt = queues[stage, head[stage]]
+                head[stage] += 1
+                started[nxt] = now
+                events.push(now + services[stage, nxt], stage, nxt)
+            else:
+                free_[stage] += 1
+            if stage == 2:
+                continue
+            stage += 1
+            if free_[stage] > 0:
+                free_[stage] -= 1
+                started[ev.pid] = now
+                events.push(now + services[stage, ev.pid], stage, ev.pid)
+            else:
+                queues[stage, tail[stage]] = ev.pid
+                tail[stage] += 1
+
+    return part_ids_arr[:n], stages_arr[:n], starts_arr[:n], finishes_arr[:n]